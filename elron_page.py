@@ -0,0 +1,24 @@
+"""
+Selectors and browser settings for rendering the Elron search results page,
+shared by the API and the command-line scraper
+"""
+
+# Trip rows on the Elron results page
+TRIP_SELECTOR = "div[class*='trip']"
+
+# Joins the rendered text of the outermost trip rows in the page, so the
+# browser hands back one small string instead of one round-trip per row
+TRIP_TEXT_SCRIPT = """
+const selector = arguments[0];
+return Array.from(document.querySelectorAll(selector))
+    .filter(elem => !elem.parentElement.closest(selector))
+    .map(elem => elem.innerText)
+    .join('\\n');
+"""
+
+# Requests the results page doesn't need to render trip times
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp",
+    "*.woff", "*.woff2", "*.ttf",
+    "*googletagmanager*", "*google-analytics*", "*doubleclick*", "*facebook*", "*hotjar*",
+]
@@ -1,10 +1,22 @@
 import os
 import re
 import time
+import asyncio
+import hashlib
+import queue
+import threading
+from functools import lru_cache
+from itertools import islice, permutations
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from fastapi import FastAPI, HTTPException, Query
+from typing import List, Dict, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+import httpx
+import orjson
+import redis.asyncio as redis
+from redis.exceptions import RedisError
 
 # Selenium imports
 from selenium import webdriver
@@ -13,18 +25,31 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
+from elron_page import BLOCKED_URLS, TRIP_SELECTOR, TRIP_TEXT_SCRIPT
 
-app = FastAPI(title="Estonian Train Times API", version="1.0.0")
+try:
+    # Optional (pip install -r requirements-re2.txt): google-re2 scans in linear
+    # time and is a drop-in for re on this pattern
+    import re2 as _regex_engine
+except ImportError:
+    _regex_engine = re
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(title="Estonian Train Times API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Add CORS middleware. Set CORS_ALLOW_ORIGINS to a comma-separated list to
+# restrict origins, or to an empty string when a reverse proxy adds the
+# CORS headers so the middleware is left out of the request path entirely.
+CORS_ALLOW_ORIGINS = os.environ.get("CORS_ALLOW_ORIGINS", "*")
+if CORS_ALLOW_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[origin.strip() for origin in CORS_ALLOW_ORIGINS.split(",")],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 # Supported Estonian cities
 SUPPORTED_CITIES = {
@@ -34,29 +59,142 @@ SUPPORTED_CITIES = {
     "pärnu": "Pärnu",
     "viljandi": "Viljandi"
 }
+_CITY_KEYS = frozenset(SUPPORTED_CITIES)
+_CITY_NAMES = list(SUPPORTED_CITIES.values())
+_CITY_NAMES_STR = str(_CITY_NAMES)
+
+# Scraped train: (departure minute of day, departure HH:MM, arrival HH:MM)
+Train = Tuple[int, str, str]
+
+# Scraped schedules are cached in Redis when REDIS_URL is configured
+REDIS_URL = os.environ.get("REDIS_URL")
+redis_client = redis.from_url(REDIS_URL) if REDIS_URL else None
+
+# Cache lifetimes by how far ahead the travel date is
+CACHE_TTL_TODAY_SECONDS = 60
+CACHE_TTL_TOMORROW_SECONDS = 300
+CACHE_TTL_LATER_SECONDS = 3600
+
+# Last good schedule kept in Redis so any worker can serve it while Elron is unreachable
+CACHE_STALE_TTL_SECONDS = 86400
+
+# Per-process cache in front of Redis: (from, to, date) -> (expires_at, trains).
+# Expired entries stay until evicted so they can be served if a scrape fails.
+LOCAL_CACHE_MAX_ENTRIES = 128
+_local_cache: Dict[Tuple[str, str, str], Tuple[float, List[Train]]] = {}
+
+# Scrapes in progress, so concurrent misses on a route and date share one
+_refreshes: Dict[Tuple[str, str, str], "asyncio.Future[Optional[List[Train]]]"] = {}
+
+# Lets HTTP caches and clients reuse a /trains response briefly
+TRAINS_CACHE_CONTROL = "public, max-age=30"
+
+# Seconds between background passes that keep every city pair for today and
+# tomorrow cached; off unless set. Kept below today's TTL so a pass lands
+# before entries expire.
+CACHE_WARM_INTERVAL_SECONDS = int(os.environ.get("CACHE_WARM_INTERVAL_SECONDS", "0"))
+CACHE_WARM_MAX_BACKOFF_SECONDS = 3600
+CACHE_WARM_LOCK_KEY = "trains:warm-lock"
+
+# The warm-up lock outlives one route's worst-case scrape (HTTP, a wait for a
+# driver, page load and render) and is renewed before each route, so it only
+# lapses if its holder dies mid-pass
+CACHE_WARM_LOCK_SECONDS = 120
+
+# Renew or release the warm-up lock only while this worker still holds it
+_RENEW_WARM_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_WARM_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_cache_warmer = None
+
+# Routes whose last warm-up found nothing: (from, to, date) -> (retry_at, failures)
+_warm_backoff: Dict[Tuple[str, str, str], Tuple[float, int]] = {}
+
+# Headless Chrome instances kept warm for pages that only show times once
+# rendered. At most DRIVER_POOL_SIZE run at once; renders wait for a free slot.
+DRIVER_POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", "2"))
+DRIVER_ACQUIRE_TIMEOUT_SECONDS = 20
+driver_pool = queue.Queue(maxsize=DRIVER_POOL_SIZE)
+driver_slots = threading.BoundedSemaphore(DRIVER_POOL_SIZE)
+
+# Caps how long a hung Elron page can hold a threadpool thread
+DRIVER_PAGE_LOAD_TIMEOUT_SECONDS = 10
+
+# Shared client so connections to elron.pilet.ee stay alive between requests.
+# HTTP/2 needs h2 and brotli decoding needs brotli (the httpx extras); with
+# brotli installed httpx advertises "br" in Accept-Encoding on its own.
+http_client = httpx.AsyncClient(
+    http2=True,
+    follow_redirects=True,
+    headers={
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Accept-Language": "en-US,en;q=0.5",
+    },
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=10.0,
+)
+
+# YYYY-MM-DD date query parameter
+_DATE_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
+# H:MM or HH:MM after_time query parameter
+_TIME_RE = re.compile(r'([0-1]?[0-9]|2[0-3]):([0-5][0-9])')
+
+# Departure/arrival pairs rendered back to back, e.g. "20:2722:04".
+# Matched against bytes so a fetched page is never decoded.
+_TIME_PAIR_RE = _regex_engine.compile(rb'([0-1]?[0-9]|2[0-3]):([0-5][0-9])([0-1]?[0-9]|2[0-3]):([0-5][0-9])')
+
+def get_today_date():
+    """Get today's date in YYYY-MM-DD format"""
+    return datetime.now().strftime("%Y-%m-%d")
 
 def get_tomorrow_date():
     """Get tomorrow's date in YYYY-MM-DD format"""
     tomorrow = datetime.now() + timedelta(days=1)
     return tomorrow.strftime("%Y-%m-%d")
 
-def parse_time(time_str: str) -> tuple:
-    """Parse time string to hour and minute for comparison"""
-    try:
-        hour, minute = map(int, time_str.split(':'))
-        return hour, minute
-    except:
-        return 0, 0
+@lru_cache(maxsize=1440)
+def parse_after_time(after_time: str) -> Optional[int]:
+    """Convert an H:MM or HH:MM time to minutes since midnight, or None if invalid"""
+    match = _TIME_RE.fullmatch(after_time)
+    if not match:
+        return None
+    return int(match[1]) * 60 + int(match[2])
 
-def is_time_after(time_str: str, after_time: str) -> bool:
-    """Check if time_str is after after_time"""
-    time_hour, time_min = parse_time(time_str)
-    after_hour, after_min = parse_time(after_time)
+def extract_train_times(content: bytes) -> List[Train]:
+    """Extract unique (departure minutes, departure, arrival) trains from page content"""
+    matches = _TIME_PAIR_RE.findall(content)
     
-    time_minutes = time_hour * 60 + time_min
-    after_minutes = after_hour * 60 + after_min
+    # Remove duplicates, keeping page order; hours are zero-padded first so
+    # "9:05" and "09:05" dedupe together
+    train_times = dict.fromkeys(
+        (dep_hour.zfill(2), dep_min, arr_hour.zfill(2), arr_min)
+        for dep_hour, dep_min, arr_hour, arr_min in matches
+    )
     
-    return time_minutes >= after_minutes
+    # Minutes are computed once here so filtering never re-parses strings
+    return [
+        (
+            int(dep_hour) * 60 + int(dep_min),
+            (dep_hour + b":" + dep_min).decode("ascii"),
+            (arr_hour + b":" + arr_min).decode("ascii"),
+        )
+        for dep_hour, dep_min, arr_hour, arr_min in train_times
+    ]
+
+@lru_cache(maxsize=None)
+def get_chromedriver_path() -> str:
+    """Resolve the chromedriver binary once per process"""
+    return ChromeDriverManager().install()
 
 def create_driver():
     """Create and configure Chrome WebDriver"""
@@ -68,8 +206,7 @@ def create_driver():
     chrome_options.add_argument("--window-size=1920,1080")
     chrome_options.add_argument("--disable-extensions")
     chrome_options.add_argument("--disable-plugins")
-    chrome_options.add_argument("--disable-images")
-    chrome_options.add_argument("--disable-javascript")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
     chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
     
     # For Railway deployment
@@ -78,67 +215,324 @@ def create_driver():
         chrome_options.binary_location = chrome_binary_path
     
     try:
-        service = Service(ChromeDriverManager().install())
+        service = Service(get_chromedriver_path())
         driver = webdriver.Chrome(service=service, options=chrome_options)
+        driver.set_page_load_timeout(DRIVER_PAGE_LOAD_TIMEOUT_SECONDS)
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
         return driver
     except Exception as e:
         print(f"Error creating driver: {e}")
         return None
 
-def scrape_train_times(from_city: str, to_city: str, date: str, after_time: str = "15:00", limit: int = 3) -> List[Dict[str, Any]]:
-    """Scrape train times using Selenium"""
+def acquire_driver():
+    """Take a warm driver from the pool, or start a new one if none is idle"""
+    try:
+        return driver_pool.get_nowait()
+    except queue.Empty:
+        return create_driver()
+
+def release_driver(driver):
+    """Return a driver to the pool, quitting it if the pool is full or it fails to reset"""
+    try:
+        driver.delete_all_cookies()
+        driver_pool.put_nowait(driver)
+    except queue.Full:
+        driver.quit()
+    except Exception as e:
+        print(f"Error resetting driver: {e}")
+        driver.quit()
+
+def render_train_times(url: str) -> Optional[List[Train]]:
+    """Render the search page in headless Chrome and extract train times from the trip rows"""
+    if not driver_slots.acquire(timeout=DRIVER_ACQUIRE_TIMEOUT_SECONDS):
+        print(f"Error rendering train times: no free driver for {url}")
+        return None
+    
     driver = None
+    reusable = False
     try:
-        driver = create_driver()
+        driver = acquire_driver()
         if not driver:
-            return []
+            return None
         
-        # Navigate to the URL
-        url = f"https://elron.pilet.ee/en/otsing/{from_city}/{to_city}/{date}"
-        driver.get(url)
+        try:
+            driver.get(url)
+        except TimeoutException:
+            print(f"Error rendering train times: page load timed out for {url}")
+            return None
         
-        # Wait for the page to load
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
-        
-        # Get page source and extract times with regex
-        page_source = driver.page_source
-        
-        # Pattern to match times like "20:27" followed by another time "22:04"
-        time_pattern = r'([0-1]?[0-9]|2[0-3]):([0-5][0-9])([0-1]?[0-9]|2[0-3]):([0-5][0-9])'
-        matches = re.findall(time_pattern, page_source)
-        
-        train_times = []
-        for match in matches:
-            departure = f"{match[0].zfill(2)}:{match[1]}"
-            arrival = f"{match[2].zfill(2)}:{match[3]}"
-            
-            # Filter by time
-            if is_time_after(departure, after_time):
-                train_times.append({
-                    "departure": departure,
-                    "arrival": arrival,
-                    "display": f"Depart: {departure} → Arrive: {arrival}"
-                })
-        
-        # Remove duplicates and limit results
-        seen = set()
-        unique_trains = []
-        for train in train_times:
-            train_key = f"{train['departure']}-{train['arrival']}"
-            if train_key not in seen:
-                seen.add(train_key)
-                unique_trains.append(train)
+        # No trip rows means no trains for this route and date
+        try:
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, TRIP_SELECTOR)))
+        except TimeoutException:
+            reusable = True
+            return []
         
-        return unique_trains[:limit]
+        all_text = driver.execute_script(TRIP_TEXT_SCRIPT, TRIP_SELECTOR) or ""
+        reusable = True
+        return extract_train_times(all_text.encode())
         
     except Exception as e:
-        print(f"Error scraping train times: {e}")
-        return []
+        print(f"Error rendering train times: {e}")
+        return None
     finally:
         if driver:
-            driver.quit()
+            # A driver that errored mid-scrape may be wedged; don't hand it out again
+            if reusable:
+                release_driver(driver)
+            else:
+                driver.quit()
+        driver_slots.release()
+
+async def scrape_train_times(from_city: str, to_city: str, date: str) -> Optional[List[Train]]:
+    """Get all train times for a route and date from Elron, or None if the page can't be loaded"""
+    url = f"https://elron.pilet.ee/en/otsing/{from_city}/{to_city}/{date}"
+    try:
+        response = await http_client.get(url)
+    except httpx.HTTPError as e:
+        print(f"Error fetching train times: {e}")
+        return None
+    
+    if response.status_code != 200:
+        print(f"Error fetching train times: HTTP {response.status_code} for {url}")
+        return None
+    
+    trains = extract_train_times(response.content)
+    if trains:
+        return trains
+    
+    # The search page is rendered client-side by the Elron app, so when the
+    # plain HTML has no times, render it in Chrome (off the event loop)
+    return await run_in_threadpool(render_train_times, url)
+
+def cache_ttl(date: str) -> int:
+    """Cache lifetime for a travel date; schedules close to departure change more often"""
+    days_ahead = (datetime.fromisoformat(date).date() - datetime.now().date()).days
+    if days_ahead <= 0:
+        return CACHE_TTL_TODAY_SECONDS
+    if days_ahead == 1:
+        return CACHE_TTL_TOMORROW_SECONDS
+    return CACHE_TTL_LATER_SECONDS
+
+def redis_key(from_city: str, to_city: str, date: str) -> str:
+    """Redis key for a route and date; v2 entries are Train tuples rather than response dicts"""
+    return f"trains:v2:{from_city}:{to_city}:{date}"
+
+def stale_redis_key(from_city: str, to_city: str, date: str) -> str:
+    """Redis key for the long-lived copy served when a scrape fails"""
+    return f"trains:v2:stale:{from_city}:{to_city}:{date}"
+
+def cache_locally(key: Tuple[str, str, str], trains: List[Train], ttl: int):
+    """Store trains in the per-process cache, evicting the oldest entry when full"""
+    _local_cache.pop(key, None)
+    if len(_local_cache) >= LOCAL_CACHE_MAX_ENTRIES:
+        _local_cache.pop(next(iter(_local_cache)))
+    _local_cache[key] = (time.time() + ttl, trains)
+
+async def get_all_trains(from_city: str, to_city: str, date: str) -> Optional[List[Train]]:
+    """Get all train times for a route and date, served from cache when possible, or None if unavailable"""
+    key = (from_city, to_city, date)
+    hit = _local_cache.get(key)
+    if hit and hit[0] > time.time():
+        return hit[1]
+    
+    if redis_client:
+        try:
+            # Read the remaining lifetime with the value so the local copy
+            # expires together with the Redis entry rather than a full TTL later
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(redis_key(from_city, to_city, date))
+                pipe.ttl(redis_key(from_city, to_city, date))
+                cached, ttl = await pipe.execute()
+            if cached:
+                trains = orjson.loads(cached)
+                cache_locally(key, trains, ttl if ttl > 0 else cache_ttl(date))
+                return trains
+        except RedisError as e:
+            print(f"Error reading train cache: {e}")
+    
+    trains = await refresh_trains(from_city, to_city, date)
+    
+    # Serve the last known schedule rather than nothing when Elron is unreachable
+    if trains is None:
+        if hit:
+            return hit[1]
+        if redis_client:
+            try:
+                stale = await redis_client.get(stale_redis_key(from_city, to_city, date))
+                if stale:
+                    return orjson.loads(stale)
+            except RedisError as e:
+                print(f"Error reading stale train cache: {e}")
+        return None
+    
+    return trains
+
+async def refresh_trains(from_city: str, to_city: str, date: str) -> Optional[List[Train]]:
+    """Scrape and cache a route and date, joining a scrape already in progress for it"""
+    key = (from_city, to_city, date)
+    refresh = _refreshes.get(key)
+    if refresh is None:
+        refresh = asyncio.ensure_future(scrape_and_cache(from_city, to_city, date))
+        _refreshes[key] = refresh
+        refresh.add_done_callback(lambda _: _refreshes.pop(key, None))
+    
+    # Shielded so one caller disconnecting doesn't cancel the scrape for the rest
+    return await asyncio.shield(refresh)
+
+async def scrape_and_cache(from_city: str, to_city: str, date: str) -> Optional[List[Train]]:
+    """Scrape a route and date and store the result in both cache layers"""
+    trains = await scrape_train_times(from_city, to_city, date)
+    
+    # Empty results usually mean the page didn't render the schedule, so don't cache them
+    if trains:
+        ttl = cache_ttl(date)
+        cache_locally((from_city, to_city, date), trains, ttl)
+        if redis_client:
+            try:
+                payload = orjson.dumps(trains)
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.setex(redis_key(from_city, to_city, date), ttl, payload)
+                    pipe.setex(stale_redis_key(from_city, to_city, date), CACHE_STALE_TTL_SECONDS, payload)
+                    await pipe.execute()
+            except RedisError as e:
+                print(f"Error writing train cache: {e}")
+    
+    return trains
+
+def warm_interval() -> int:
+    """Seconds between warm-up passes, capped at half of today's TTL"""
+    return min(CACHE_WARM_INTERVAL_SECONDS, CACHE_TTL_TODAY_SECONDS // 2)
+
+async def claim_warm_pass(token: str) -> bool:
+    """Let only one worker warm the shared Redis cache at a time"""
+    if not redis_client:
+        return True
+    try:
+        return bool(await redis_client.set(CACHE_WARM_LOCK_KEY, token, nx=True, ex=CACHE_WARM_LOCK_SECONDS))
+    except RedisError as e:
+        print(f"Error claiming cache warm-up: {e}")
+        return True
+
+async def renew_warm_pass(token: str) -> bool:
+    """Extend the warm-up lock, or report that another worker has taken over"""
+    if not redis_client:
+        return True
+    try:
+        return bool(await redis_client.eval(_RENEW_WARM_LOCK_SCRIPT, 1, CACHE_WARM_LOCK_KEY, token, CACHE_WARM_LOCK_SECONDS))
+    except RedisError as e:
+        print(f"Error renewing cache warm-up: {e}")
+        return True
+
+async def release_warm_pass(token: str):
+    """Hand the warm-up lock back once the pass is done"""
+    if not redis_client:
+        return
+    try:
+        await redis_client.eval(_RELEASE_WARM_LOCK_SCRIPT, 1, CACHE_WARM_LOCK_KEY, token)
+    except RedisError as e:
+        print(f"Error releasing cache warm-up: {e}")
+
+async def remaining_lifetimes(keys: List[Tuple[str, str, str]]) -> List[float]:
+    """Seconds until each route's cached schedule expires, locally or in Redis"""
+    now = time.time()
+    remaining = [_local_cache[key][0] - now if key in _local_cache else 0 for key in keys]
+    if redis_client:
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.ttl(redis_key(*key))
+                ttls = await pipe.execute()
+            remaining = [max(local, ttl) for local, ttl in zip(remaining, ttls)]
+        except RedisError as e:
+            print(f"Error reading train cache lifetimes: {e}")
+    return remaining
+
+async def warm_cache():
+    """Periodically refresh every city pair for today and tomorrow before it expires"""
+    interval = warm_interval()
+    while True:
+        token = os.urandom(8).hex()
+        if await claim_warm_pass(token):
+            try:
+                await warm_pass(interval, token)
+            finally:
+                await release_warm_pass(token)
+        await asyncio.sleep(interval)
+
+async def warm_pass(interval: int, token: str):
+    """Refresh every city pair for today and tomorrow that expires before the next pass"""
+    dates = (get_today_date(), get_tomorrow_date())
+    keys = [
+        (from_city, to_city, date)
+        for date in dates
+        for from_city, to_city in permutations(_CITY_NAMES, 2)
+    ]
+    
+    # Backoff for dates that are no longer warmed would otherwise pile up forever
+    for key in [key for key in _warm_backoff if key[2] not in dates]:
+        del _warm_backoff[key]
+    for key, remaining in zip(keys, await remaining_lifetimes(keys)):
+        if remaining > interval:
+            continue
+        
+        # Back off routes that keep coming back empty instead of
+        # re-scraping them every pass
+        retry_at, failures = _warm_backoff.get(key, (0, 0))
+        if retry_at > time.time():
+            continue
+        if not await renew_warm_pass(token):
+            print("Cache warm-up lock lost; leaving the rest of the pass to its new holder")
+            return
+        try:
+            trains = await refresh_trains(*key)
+        except Exception as e:
+            print(f"Error warming train cache: {e}")
+            trains = None
+        if trains:
+            _warm_backoff.pop(key, None)
+        else:
+            delay = min(interval * 2 ** failures, CACHE_WARM_MAX_BACKOFF_SECONDS)
+            _warm_backoff[key] = (time.time() + delay, failures + 1)
+
+@app.on_event("startup")
+async def start_cache_warmer():
+    global _cache_warmer
+    if CACHE_WARM_INTERVAL_SECONDS >= CACHE_TTL_TODAY_SECONDS:
+        print(f"CACHE_WARM_INTERVAL_SECONDS={CACHE_WARM_INTERVAL_SECONDS} is not below today's "
+              f"{CACHE_TTL_TODAY_SECONDS}s cache TTL; warming every {warm_interval()}s instead")
+    if warm_interval() > 0:
+        _cache_warmer = asyncio.create_task(warm_cache())
+
+@app.on_event("shutdown")
+async def stop_cache_warmer():
+    if _cache_warmer:
+        _cache_warmer.cancel()
+
+@app.on_event("shutdown")
+def close_driver_pool():
+    while True:
+        try:
+            driver_pool.get_nowait().quit()
+        except queue.Empty:
+            break
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
+@app.on_event("shutdown")
+async def close_redis():
+    if redis_client:
+        await redis_client.aclose()
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110 13.1.2)"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(","))
 
 @app.get("/")
 async def root():
@@ -147,11 +541,13 @@ async def root():
         "endpoints": {
             "/trains": "Get train departure times",
         },
-        "supported_cities": list(SUPPORTED_CITIES.values())
+        "supported_cities": _CITY_NAMES
     }
 
 @app.get("/trains")
 async def get_trains(
+    request: Request,
+    response: Response,
     from_city: str = Query(..., description="Departure city"),
     to_city: str = Query(..., description="Destination city"), 
     date: str = Query("tomorrow", description="Date in YYYY-MM-DD format or 'tomorrow'"),
@@ -167,28 +563,58 @@ async def get_trains(
     to_city = to_city.lower().strip()
     
     # Validate cities
-    if from_city not in SUPPORTED_CITIES:
-        raise HTTPException(status_code=400, detail=f"Unsupported departure city. Supported: {list(SUPPORTED_CITIES.values())}")
+    if from_city not in _CITY_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported departure city. Supported: {_CITY_NAMES_STR}")
     
-    if to_city not in SUPPORTED_CITIES:
-        raise HTTPException(status_code=400, detail=f"Unsupported destination city. Supported: {list(SUPPORTED_CITIES.values())}")
+    if to_city not in _CITY_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unsupported destination city. Supported: {_CITY_NAMES_STR}")
     
-    # Handle date
+    # Handle date; only caller-supplied dates need validating
     if date.lower() == "tomorrow":
         date = get_tomorrow_date()
-    
-    # Validate date format
-    try:
-        datetime.strptime(date, "%Y-%m-%d")
-    except ValueError:
+    elif not _DATE_RE.fullmatch(date):
         raise HTTPException(status_code=400, detail="Date must be in YYYY-MM-DD format or 'tomorrow'")
+    else:
+        # datetime() rejects impossible days like 2024-02-30
+        try:
+            datetime(int(date[:4]), int(date[5:7]), int(date[8:10]))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Date must be in YYYY-MM-DD format or 'tomorrow'")
     
     # Get proper city names
     from_city_proper = SUPPORTED_CITIES[from_city]
     to_city_proper = SUPPORTED_CITIES[to_city]
     
-    # Scrape train times
-    trains = scrape_train_times(from_city_proper, to_city_proper, date, after_time, limit)
+    # Validate after_time and convert it to minutes since midnight
+    after_minutes = parse_after_time(after_time)
+    if after_minutes is None:
+        raise HTTPException(status_code=400, detail="after_time must be in HH:MM format")
+    
+    # Get train times and filter by time, stopping once limit trains are found
+    all_trains = await get_all_trains(from_city_proper, to_city_proper, date)
+    matching_trains = list(islice((train for train in all_trains or () if train[0] >= after_minutes), limit))
+    
+    # An empty schedule usually means the scrape failed, so don't let it be reused
+    if not all_trains:
+        response.headers["Cache-Control"] = "no-store"
+    else:
+        # Weak ETag: the body also carries execution_time_seconds, which varies
+        etag_source = orjson.dumps([from_city_proper, to_city_proper, date, after_time, matching_trains])
+        etag = f'W/"{hashlib.blake2b(etag_source, digest_size=8).hexdigest()}"'
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": TRAINS_CACHE_CONTROL})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = TRAINS_CACHE_CONTROL
+    
+    trains = [
+        {
+            "departure": departure,
+            "arrival": arrival,
+            "display": f"Depart: {departure} → Arrive: {arrival}"
+        }
+        for departure_minutes, departure, arrival in matching_trains
+    ]
     
     execution_time = round(time.time() - start_time, 2)
     
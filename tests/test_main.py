@@ -0,0 +1,158 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+import httpx
+import orjson
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def reset_caches(monkeypatch):
+    """Start every test with empty caches, no Redis and no real scraping"""
+    monkeypatch.setattr(main, "_local_cache", {})
+    monkeypatch.setattr(main, "_refreshes", {})
+    monkeypatch.setattr(main, "redis_client", None)
+
+
+def fake_scraper(monkeypatch, *results):
+    """Make scrape_train_times return each result in turn, recording its calls"""
+    calls = []
+    remaining = list(results)
+
+    async def scrape(from_city, to_city, date):
+        calls.append((from_city, to_city, date))
+        return remaining.pop(0)
+
+    monkeypatch.setattr(main, "scrape_train_times", scrape)
+    return calls
+
+
+TRAINS = [(1000, "16:40", "18:00"), (1100, "18:20", "19:45")]
+
+
+def days_from_today(days):
+    return (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def test_cache_ttl_tiers():
+    assert main.cache_ttl(days_from_today(0)) == main.CACHE_TTL_TODAY_SECONDS
+    assert main.cache_ttl(days_from_today(1)) == main.CACHE_TTL_TOMORROW_SECONDS
+    assert main.cache_ttl(days_from_today(7)) == main.CACHE_TTL_LATER_SECONDS
+
+
+def test_scraped_trains_are_cached_locally(monkeypatch):
+    calls = fake_scraper(monkeypatch, TRAINS)
+    date = days_from_today(1)
+
+    assert asyncio.run(main.get_all_trains("Tallinn", "Tartu", date)) == TRAINS
+    assert asyncio.run(main.get_all_trains("Tallinn", "Tartu", date)) == TRAINS
+    assert len(calls) == 1
+
+
+def test_stale_local_copy_served_when_scrape_fails(monkeypatch):
+    calls = fake_scraper(monkeypatch, None)
+    date = days_from_today(0)
+    main._local_cache[("Tallinn", "Tartu", date)] = (0, TRAINS)
+
+    assert asyncio.run(main.get_all_trains("Tallinn", "Tartu", date)) == TRAINS
+    assert len(calls) == 1
+
+
+def test_nothing_to_serve_when_scrape_fails_uncached(monkeypatch):
+    fake_scraper(monkeypatch, None)
+    assert asyncio.run(main.get_all_trains("Tallinn", "Tartu", days_from_today(0))) is None
+
+
+def test_local_copy_of_redis_hit_keeps_remaining_ttl(monkeypatch):
+    calls = fake_scraper(monkeypatch)
+    monkeypatch.setattr(main, "redis_client", fakeredis.FakeAsyncRedis())
+    date = days_from_today(7)
+
+    async def run():
+        await main.redis_client.setex(main.redis_key("Tallinn", "Tartu", date), 7, orjson.dumps(TRAINS))
+        return await main.get_all_trains("Tallinn", "Tartu", date)
+
+    assert asyncio.run(run()) == [list(train) for train in TRAINS]
+    expires_at, _ = main._local_cache[("Tallinn", "Tartu", date)]
+    assert 0 < expires_at - time.time() <= 7
+    assert calls == []
+
+
+def test_stale_redis_copy_served_when_scrape_fails(monkeypatch):
+    fake_scraper(monkeypatch, TRAINS, None)
+    monkeypatch.setattr(main, "redis_client", fakeredis.FakeAsyncRedis())
+    date = days_from_today(0)
+
+    async def run():
+        await main.get_all_trains("Tallinn", "Tartu", date)
+        # A fresh worker: the shared entry has expired and nothing is cached locally
+        main._local_cache.clear()
+        await main.redis_client.delete(main.redis_key("Tallinn", "Tartu", date))
+        return await main.get_all_trains("Tallinn", "Tartu", date)
+
+    assert asyncio.run(run()) == [list(train) for train in TRAINS]
+
+
+def get_trains(*headers):
+    """Request /trains for Tallinn to Tartu tomorrow, once per set of headers"""
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.get("/trains", params={"from_city": "tallinn", "to_city": "tartu"}, headers=h)
+                for h in headers
+            ]
+
+    return asyncio.run(run())
+
+
+def test_trains_response_has_weak_etag(monkeypatch):
+    fake_scraper(monkeypatch, TRAINS)
+    (response,) = get_trains({})
+
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('W/"')
+    assert response.headers["cache-control"] == main.TRAINS_CACHE_CONTROL
+    assert [train["departure"] for train in response.json()["trains"]] == ["16:40", "18:20"]
+
+
+@pytest.mark.parametrize("if_none_match", [
+    lambda etag: etag,
+    lambda etag: etag.removeprefix("W/"),
+    lambda etag: f'"other", {etag}',
+    lambda etag: "*",
+])
+def test_matching_if_none_match_gets_304(monkeypatch, if_none_match):
+    fake_scraper(monkeypatch, TRAINS)
+    (first,) = get_trains({})
+    etag = first.headers["etag"]
+    # The schedule is cached locally now, so no second scrape is needed
+    (response,) = get_trains({"If-None-Match": if_none_match(etag)})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_other_if_none_match_gets_full_response(monkeypatch):
+    fake_scraper(monkeypatch, TRAINS)
+    (response,) = get_trains({"If-None-Match": 'W/"0000000000000000"'})
+
+    assert response.status_code == 200
+    assert response.json()["trains"]
+
+
+@pytest.mark.parametrize("scraped", [[], None])
+def test_empty_schedule_is_not_cacheable(monkeypatch, scraped):
+    fake_scraper(monkeypatch, scraped)
+    (response,) = get_trains({"If-None-Match": "*"})
+
+    assert response.status_code == 200
+    assert response.json()["trains"] == []
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"] == "no-store"